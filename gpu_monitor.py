@@ -5,22 +5,52 @@ This script is most useful in conjunction with an ssh-key, so a password does
 not have to be entered for each SSH connection.
 """
 import argparse
+import asyncio
+import io
 import logging
 import os
+import pathlib
 import pwd
+import socket
 import subprocess
 import sys
+import time
 import xml.etree.ElementTree as ET
-from collections import defaultdict
-from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
 from logging import debug, info, error
 
+# lxml parses the large nvidia-smi XML considerably faster than the
+# stdlib parser, but is not required
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+# With asyncssh, servers are probed on one event loop with persistent
+# SSH sessions instead of one thread and ssh process per server. Also
+# not required; without it the threaded fan-out is used
+try:
+    import asyncssh
+except ImportError:
+    asyncssh = None
+
+# Maximum number of servers probed concurrently
+MAX_WORKERS = 32
+
+# Server names probed locally instead of over SSH
+LOCAL_SERVERS = frozenset({'.', 'localhost', '127.0.0.1', '::1',
+                           socket.gethostname(), socket.getfqdn()})
+
 # Default timeout in seconds after which SSH stops trying to connect
 DEFAULT_SSH_TIMEOUT = 3
 
 # Default timeout in seconds after which remote commands are interrupted
 DEFAULT_CMD_TIMEOUT = 10
 
+# Default interval in seconds between checks in daemon mode
+DEFAULT_INTERVAL = 15
+
 # Default server file
 DEFAULT_SERVER_FILE = 'servers.txt'
 SERVER_FILE_PATH = os.path.join(os.path.dirname(os.path.realpath(sys.argv[0])),
@@ -37,126 +67,302 @@ parser.add_argument('-m', '--me', action='store_true',
 parser.add_argument('-u', '--user', help='Shows only GPUs used by a user')
 parser.add_argument('-s', '--ssh-user', default=None,
                     help='Username to use to connect with SSH')
+parser.add_argument('-d', '--daemon', action='store_true',
+                    help='Keep checking the servers until interrupted')
+parser.add_argument('--interval', default=DEFAULT_INTERVAL,
+                    help='Interval in seconds between checks in daemon mode')
 parser.add_argument('--ssh-timeout', default=DEFAULT_SSH_TIMEOUT,
                     help='Timeout in seconds after which SSH stops to connect')
 parser.add_argument('--cmd-timeout', default=DEFAULT_CMD_TIMEOUT,
                     help=('Timeout in seconds after which nvidia-smi '
                           'is interrupted'))
+parser.add_argument('--legacy-xml', action='store_true',
+                    help=('Query nvidia-smi as XML instead of CSV, for '
+                          'drivers without the CSV query options'))
 parser.add_argument('--server-file', default=SERVER_FILE_PATH,
                     help='File with addresses of servers to check')
 parser.add_argument('servers', nargs='*', default=[],
                     help='Servers to probe')
 
-# SSH command
-SSH_CMD = ('ssh -o "ConnectTimeout={ssh_timeout}" {server} '
-           'timeout {cmd_timeout}')
+# Directory for SSH control sockets used for connection multiplexing
+CONTROL_PATH_DIR = os.path.join(os.path.expanduser('~'), '.cache',
+                                'gpu-monitor')
+
+# Command for running nvidia-smi locally with XML output
+NVIDIASMI_ARGV = ['nvidia-smi', '-q', '-x']
+
+# Commands for querying only the fields we need as CSV, which is an
+# order of magnitude smaller and faster to parse than the full XML.
+# Processes are matched to their GPU through the GPU UUID
+NVIDIASMI_CSV_GPUS_ARGV = ['nvidia-smi', '--query-gpu=index,name,uuid',
+                           '--format=csv,noheader']
+NVIDIASMI_CSV_APPS_ARGV = ['nvidia-smi',
+                           '--query-compute-apps=gpu_uuid,pid',
+                           '--format=csv,noheader']
+
+# Delimiter between the GPU and process halves of the CSV output
+CSV_SPLIT = '---'
+
+# Delimiter between the sections of the batched remote command
+BATCH_SPLIT = '---GPU-MONITOR-SPLIT---'
+
+# Optional section of the batched remote script resolving user names to
+# real names. getent is a single binary exec, much cheaper than starting
+# a remote python interpreter; unknown users are simply absent from its
+# output. The inner guard keeps getent from dumping the whole passwd
+# database when there are no users
+REAL_NAMES_SECTION = """if [ -n "$pids" ]; then
+users=$(ps -o ruser= -p "$pids" | sort -u)
+if [ -n "$users" ]; then
+getent passwd $users
+fi
+fi"""
+
+# nvidia-smi section of the batched remote script, in both flavors. The
+# XML flavor keeps the output in a variable so the PID list can be
+# derived from it below without the CSV query options, which are not
+# available on exactly the drivers --legacy-xml targets
+SMI_XML_SECTION = ('xml=$(nvidia-smi -q -x)\n'
+                   'printf \'%s\\n\' "$xml"')
+SMI_CSV_SECTION = """nvidia-smi --query-gpu=index,name,uuid \
+--format=csv,noheader
+echo {csv_split}
+nvidia-smi --query-compute-apps=gpu_uuid,pid --format=csv,noheader"""
+
+# Commands collecting the GPU process PIDs for ps, matching the two
+# nvidia-smi flavors above
+CSV_PIDS_SECTION = ('pids=$(nvidia-smi --query-compute-apps=pid '
+                    '--format=csv,noheader | paste -sd, -)')
+XML_PIDS_SECTION = ('pids=$(printf \'%s\\n\' "$xml" | '
+                    'sed -n \'s:.*<pid>\\([0-9][0-9]*\\)</pid>.*:\\1:p\' | '
+                    'paste -sd, -)')
+
+# Script gathering nvidia-smi, ps and optionally real name output in a
+# single remote invocation, so each server pays for only one SSH command.
+# It is fed to a remote shell on stdin
+BATCH_SCRIPT = """{smi_section}
+echo {split}
+{pids_section}
+if [ -n "$pids" ]; then
+ps -o pid= -o ruser= -p "$pids"
+fi
+echo {split}
+{real_names_section}
+true
+"""
 
-# Command for running nvidia-smi locally
-NVIDIASMI_CMD = 'nvidia-smi -q -x'
 
-# Command for running nvidia-smi remotely
-REMOTE_NVIDIASMI_CMD = '{} {}'.format(SSH_CMD, NVIDIASMI_CMD)
+def ssh_argv(server, ssh_timeout, cmd_timeout, *remote_argv):
+    """Builds the argument list for running a command over SSH.
 
-# Command for running ps locally
-PS_CMD = 'ps -o pid= -o ruser= -p {pids}'
+    ControlMaster lets all commands to the same server reuse one
+    connection, so only the first one pays the TCP and auth setup.
+    """
+    return ['ssh',
+            '-o', 'ConnectTimeout={}'.format(ssh_timeout),
+            '-o', 'ControlMaster=auto',
+            '-o', 'ControlPersist=60s',
+            '-o', 'ControlPath={}/cm-%C'.format(CONTROL_PATH_DIR),
+            server, 'timeout', str(cmd_timeout)] + list(remote_argv)
 
-# Command for running ps remotely
-REMOTE_PS_CMD = '{} {}'.format(SSH_CMD, PS_CMD)
 
-# Command for getting real names remotely
-# See https://stackoverflow.com/a/38235661
-REAL_NAMES_CMD = """<<-"EOF"
-import pwd
-for user in [{users}]:
-    try:
-        print(pwd.getpwnam(user).pw_gecos)
-    except KeyError:
-        print('Unknown')
-EOF
-"""
-REMOTE_REAL_NAMES_CMD = '{} python - {}'.format(SSH_CMD, REAL_NAMES_CMD)
+def ps_argv(pids):
+    return ['ps', '-o', 'pid=', '-o', 'ruser=', '-p', ','.join(pids)]
 
 
-def run_command(cmd):
-    debug('Running command: "{}"'.format(cmd))
+def run_command(argv, cmd_input=None, timeout=None):
+    # Only build debug strings when they are actually emitted; decoding
+    # command output is not free
+    debug_enabled = logging.getLogger().isEnabledFor(logging.DEBUG)
+    if debug_enabled:
+        debug('Running command: "%s"', ' '.join(argv))
 
     try:
-        res = subprocess.check_output(cmd, shell=True)
+        res = subprocess.run(argv, input=cmd_input, timeout=timeout,
+                             stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE, check=True)
     except subprocess.TimeoutExpired as e:
-        debug(('Command timeouted with output "{}", '
-               'and stderr "{}"'.format(e.output.decode('utf-8'), e.stderr)))
+        if debug_enabled:
+            debug('Command timeouted with output "%s", and stderr "%s"',
+                  _decode(e.output), _decode(e.stderr))
         return None
     except subprocess.CalledProcessError as e:
-        debug(('Command failed with exit code {}, output "{}", '
-               'and stderr "{}"'.format(e.returncode,
-                                        e.output.decode('utf-8'),
-                                        e.stderr)))
+        if debug_enabled:
+            debug('Command failed with exit code %s, output "%s", '
+                  'and stderr "%s"',
+                  e.returncode, _decode(e.output), _decode(e.stderr))
         return None
 
-    return res
+    return res.stdout
+
+
+def _decode(output):
+    return output.decode('utf-8') if output is not None else ''
 
 
-def run_nvidiasmi_local():
-    res = run_command(NVIDIASMI_CMD)
-    return ET.fromstring(res) if res is not None else None
+def parse_nvidiasmi_csv(gpus_output, apps_output):
+    """Parses the CSV outputs of the two nvidia-smi queries into the
+    same GPU info structure as the XML path."""
+    gpu_infos = []
+    infos_by_uuid = {}
+    for line in gpus_output.strip().split('\n'):
+        fields = [field.strip() for field in line.split(',')]
+        if len(fields) < 3:
+            continue
+        # nvidia-smi does not quote its CSV output, so a GPU name may
+        # itself contain commas: anchor the index on the left and the
+        # UUID on the right, and rejoin whatever lies between
+        idx, uuid = fields[0], fields[-1]
+        model = ', '.join(fields[1:-1])
+        gpu_info = {'idx': int(idx), 'model': model, 'pids': []}
+        gpu_infos.append(gpu_info)
+        infos_by_uuid[uuid] = gpu_info
+
+    for line in apps_output.strip().split('\n'):
+        fields = [field.strip() for field in line.split(',')]
+        if len(fields) < 2:
+            continue
+        uuid, pid = fields[0], fields[1]
+        if uuid in infos_by_uuid:
+            infos_by_uuid[uuid]['pids'].append(pid)
 
+    return gpu_infos if len(gpu_infos) > 0 else None
 
-def run_nvidiasmi_remote(server, ssh_timeout, cmd_timeout):
-    cmd = REMOTE_NVIDIASMI_CMD.format(server=server,
-                                      ssh_timeout=ssh_timeout,
-                                      cmd_timeout=cmd_timeout)
-    res = run_command(cmd)
-    return ET.fromstring(res) if res is not None else None
+
+def run_nvidiasmi_local(legacy_xml=False):
+    if legacy_xml:
+        res = run_command(NVIDIASMI_ARGV)
+        return parse_nvidiasmi(res) if res is not None else None
+
+    gpus = run_command(NVIDIASMI_CSV_GPUS_ARGV)
+    apps = run_command(NVIDIASMI_CSV_APPS_ARGV)
+    if gpus is None or apps is None:
+        return None
+    return parse_nvidiasmi_csv(gpus.decode('utf-8'), apps.decode('utf-8'))
 
 
 def run_ps_local(pids):
-    cmd = PS_CMD.format(pids=','.join(pids))
-    res = run_command(cmd)
+    res = run_command(ps_argv(pids))
     return res.decode('ascii') if res is not None else None
 
 
-def run_ps_remote(server, pids, ssh_timeout, cmd_timeout):
-    cmd = REMOTE_PS_CMD.format(server=server,
-                               pids=','.join(pids),
-                               ssh_timeout=ssh_timeout,
-                               cmd_timeout=cmd_timeout)
-    res = run_command(cmd)
-    return res.decode('ascii') if res is not None else None
+@lru_cache(maxsize=4096)
+def _gecos_local(user):
+    try:
+        return pwd.getpwnam(user).pw_gecos
+    except KeyError:
+        return None
 
 
 def get_real_names_local(users):
     real_names_by_users = {}
     for user in users:
-        try:
-            real_names_by_users[user] = pwd.getpwnam(user).pw_gecos
-        except KeyError:
-            pass
-    return defaultdict(lambda: 'Unknown', real_names_by_users)
-
-
-def get_real_names_remote(server, users, ssh_timeout, cmd_timeout):
-    users_str = ','.join(('\'{}\''.format(user) for user in users))
-    cmd = REMOTE_REAL_NAMES_CMD.format(server=server,
-                                       users=users_str,
-                                       ssh_timeout=ssh_timeout,
-                                       cmd_timeout=cmd_timeout)
-    res = run_command(cmd)
-    if res is not None:
-        res = res.decode('utf-8')
-        real_names_by_users = {user: s.strip()
-                               for user, s in zip(users, res.split('\n'))}
-        return defaultdict(lambda: 'Unknown', real_names_by_users)
+        gecos = _gecos_local(user)
+        if gecos is not None:
+            real_names_by_users[user] = gecos
+    return real_names_by_users
+
+
+# Cache from (server, user) to real name, so remotely resolved names are
+# reused and survive transient lookup failures
+_real_names_cache = {}
+
+
+def merge_cached_real_names(server, users, real_names_by_users):
+    for user, real_name in real_names_by_users.items():
+        _real_names_cache[(server, user)] = real_name
+
+    merged = dict(real_names_by_users)
+    for user in users:
+        if user not in merged and (server, user) in _real_names_cache:
+            merged[user] = _real_names_cache[(server, user)]
+    return merged
+
+
+def parse_real_names(res):
+    """Parses getent passwd output into a dict from user to real name."""
+    real_names_by_users = {}
+    for line in res.strip().split('\n'):
+        fields = line.split(':')
+        if len(fields) > 4 and fields[0] != '':
+            real_names_by_users[fields[0]] = fields[4]
+    return real_names_by_users
+
+
+def build_batch_script(with_real_names, legacy_xml):
+    if legacy_xml:
+        smi_section = SMI_XML_SECTION
+        pids_section = XML_PIDS_SECTION
     else:
+        smi_section = SMI_CSV_SECTION.format(csv_split=CSV_SPLIT)
+        pids_section = CSV_PIDS_SECTION
+    real_names_section = REAL_NAMES_SECTION if with_real_names else ''
+    return BATCH_SCRIPT.format(smi_section=smi_section,
+                               pids_section=pids_section,
+                               split=BATCH_SPLIT,
+                               real_names_section=real_names_section)
+
+
+def parse_batch_output(output, with_real_names, legacy_xml):
+    """Parses the sectioned output of the batched remote script.
+
+    Returns a tuple of GPU infos, ps output and a dictionary from user
+    names to real names, or None if the output is unusable.
+    """
+    sections = output.split(BATCH_SPLIT)
+    if len(sections) < 2:
         return None
 
+    nvidiasmi_output = sections[0].strip()
+    if nvidiasmi_output == '':
+        return None
+
+    if legacy_xml:
+        gpu_infos = parse_nvidiasmi(nvidiasmi_output)
+    else:
+        gpus_output, _, apps_output = nvidiasmi_output.partition(
+            '\n' + CSV_SPLIT)
+        gpu_infos = parse_nvidiasmi_csv(gpus_output, apps_output)
+    ps_output = sections[1]
+
+    real_names_by_users = {}
+    if with_real_names and len(sections) > 2:
+        real_names_by_users = parse_real_names(sections[2])
+
+    return gpu_infos, ps_output, real_names_by_users
+
+
+def run_batch_remote(server, ssh_timeout, cmd_timeout, with_real_names,
+                     legacy_xml=False):
+    """Runs nvidia-smi, ps and optionally the real name lookup remotely
+    with a single SSH command.
+
+    Returns a tuple of GPU infos, ps output and a dictionary from user
+    names to real names, or None if the command failed.
+    """
+    script = build_batch_script(with_real_names, legacy_xml)
+    argv = ssh_argv(server, ssh_timeout, cmd_timeout, 'sh')
+    # Leave some headroom over the remote timeout before giving up
+    res = run_command(argv, cmd_input=script.encode('utf-8'),
+                      timeout=float(ssh_timeout) + float(cmd_timeout) + 5)
+    if res is None:
+        return None
+
+    return parse_batch_output(res.decode('utf-8'), with_real_names,
+                              legacy_xml)
+
 
 def get_users_by_pid(ps_output):
+    """Returns a dict from PID to user, and the set of those users."""
     users_by_pid = {}
-    for line in ps_output.strip().split('\n'):
-        pid, user = line.split()
-        users_by_pid[pid] = user
+    for line in ps_output.splitlines():
+        if line.strip() == '':
+            continue
+        # Split on the first whitespace only, as ruser may contain spaces
+        pid, user = line.split(None, 1)
+        users_by_pid[pid] = user.strip()
 
-    return users_by_pid
+    return users_by_pid, set(users_by_pid.values())
 
 
 def get_gpu_infos(nvidiasmi_output):
@@ -165,46 +371,115 @@ def get_gpu_infos(nvidiasmi_output):
     gpu_infos = []
     for idx, gpu in enumerate(gpus):
         model = gpu.find('product_name').text
-        processes = gpu.findall('processes')[0]
-        pids = [process.find('pid').text for process in processes]
+        processes = gpu.find('processes')
+        if processes is not None:
+            pids = [pid.text for pid in processes.iterfind('process_info/pid')]
+        else:
+            pids = []
         gpu_infos.append({'idx': idx, 'model': model, 'pids': pids})
 
     return gpu_infos
 
 
-def print_free_gpus(server, gpu_infos):
+def parse_nvidiasmi(xml_output):
+    """Parses nvidia-smi XML output into a list of GPU infos.
+
+    Uses a streaming pass with lxml if available, which avoids building
+    a tree for the many nvidia-smi fields we do not read. Falls back to
+    ElementTree otherwise.
+    """
+    if isinstance(xml_output, str):
+        xml_output = xml_output.encode('utf-8')
+
+    # Drop BOMs and anything a login shell may have printed before the
+    # XML declaration, e.g. a message of the day over SSH
+    start = xml_output.find(b'<?xml')
+    if start == -1:
+        start = xml_output.find(b'<')
+    if start > 0:
+        xml_output = xml_output[start:]
+
+    if etree is None:
+        try:
+            return get_gpu_infos(ET.fromstring(xml_output))
+        except ET.ParseError as e:
+            debug('Could not parse nvidia-smi output: %s', e)
+            return None
+
+    gpu_infos = []
+    model = None
+    pids = []
+    in_processes = False
+    # Some driver versions emit malformed XML; with recover=True, lxml
+    # still yields the subtrees we are interested in
+    context = etree.iterparse(io.BytesIO(xml_output),
+                              events=('start', 'end'),
+                              tag=('gpu', 'processes',
+                                   'product_name', 'pid'),
+                              recover=True, resolve_entities=False,
+                              huge_tree=True)
+    try:
+        for event, elem in context:
+            if event == 'start':
+                if elem.tag == 'gpu':
+                    model, pids = None, []
+                elif elem.tag == 'processes':
+                    in_processes = True
+            else:
+                if elem.tag == 'product_name' and model is None:
+                    model = elem.text
+                elif elem.tag == 'pid' and in_processes:
+                    pids.append(elem.text)
+                elif elem.tag == 'processes':
+                    in_processes = False
+                elif elem.tag == 'gpu':
+                    gpu_infos.append({'idx': len(gpu_infos),
+                                      'model': model,
+                                      'pids': pids})
+                    # Free the subtree we are done with to cap memory
+                    elem.clear(keep_tail=True)
+    except etree.XMLSyntaxError as e:
+        debug('Could not parse nvidia-smi output: %s', e)
+        return gpu_infos if len(gpu_infos) > 0 else None
+
+    return gpu_infos if len(gpu_infos) > 0 else None
+
+
+def format_free_gpus(server, gpu_infos):
     free_gpus = [info for info in gpu_infos if len(info['pids']) == 0]
 
     if len(free_gpus) == 0:
-        info('Server {}: No free GPUs :('.format(server))
-    else:
-        info('Server {}:'.format(server))
-        for gpu_info in free_gpus:
-            info('\tGPU {}, {}'.format(gpu_info['idx'], gpu_info['model']))
+        return ['Server {}: No free GPUs :('.format(server)]
+
+    lines = ['Server {}:'.format(server)]
+    for gpu_info in free_gpus:
+        lines.append('\tGPU {}, {}'.format(gpu_info['idx'],
+                                           gpu_info['model']))
+    return lines
 
 
-def print_gpu_infos(server, gpu_infos, run_ps, run_get_real_names,
-                    filter_by_user=None,
-                    translate_to_real_names=False):
+def format_gpu_infos(server, gpu_infos, run_ps, run_get_real_names,
+                     filter_by_user=None,
+                     translate_to_real_names=False):
     pids = [pid for gpu_info in gpu_infos for pid in gpu_info['pids']]
     if len(pids) > 0:
         ps = run_ps(pids=pids)
         if ps is None:
-            error('Could not reach {} or error running ps'.format(server))
-            return
+            return ['Could not reach {} or error running ps'.format(server)]
 
-        users_by_pid = get_users_by_pid(ps)
+        users_by_pid, all_users = get_users_by_pid(ps)
     else:
-        users_by_pid = {}
+        users_by_pid, all_users = {}, set()
 
     if translate_to_real_names:
-        all_users = set((users_by_pid[pid] for gpu_info in gpu_infos
-                         for pid in gpu_info['pids']))
         real_names_by_users = run_get_real_names(users=all_users)
 
-    info('Server {}:'.format(server))
+    lines = ['Server {}:'.format(server)]
     for gpu_info in gpu_infos:
-        users = set((users_by_pid[pid] for pid in gpu_info['pids']))
+        # A process may have exited between nvidia-smi and ps; show it
+        # as unknown instead of raising for the missing PID
+        users = set((users_by_pid.get(pid, 'unknown')
+                     for pid in gpu_info['pids']))
         if filter_by_user is not None and filter_by_user not in users:
             continue
 
@@ -212,14 +487,148 @@ def print_gpu_infos(server, gpu_infos, run_ps, run_get_real_names,
             status = 'Free'
         else:
             if translate_to_real_names:
-                users = ['{} ({})'.format(user, real_names_by_users[user])
+                users = ['{} ({})'.format(
+                             user, real_names_by_users.get(user, 'Unknown'))
                          for user in users]
 
             status = 'Used by {}'.format(', '.join(users))
 
-        info('\tGPU {} ({}): {}'.format(gpu_info['idx'],
-                                        gpu_info['model'],
-                                        status))
+        lines.append('\tGPU {} ({}): {}'.format(gpu_info['idx'],
+                                                gpu_info['model'],
+                                                status))
+    return lines
+
+
+def format_lines(server, args, gpu_infos, run_ps, run_get_real_names):
+    if gpu_infos is None:
+        return ['Could not reach {} or '
+                'error running nvidia-smi'.format(server)]
+
+    if args.list:
+        return format_gpu_infos(server, gpu_infos, run_ps,
+                                run_get_real_names,
+                                filter_by_user=args.user,
+                                translate_to_real_names=args.finger)
+    return format_free_gpus(server, gpu_infos)
+
+
+def lines_from_batch(server, args, batch):
+    """Formats the result of a batched remote probe into output lines."""
+    if batch is None:
+        return format_lines(server, args, None, None, None)
+
+    gpu_infos, ps_output, real_names_by_users = batch
+
+    def run_ps(pids):
+        return ps_output if ps_output.strip() != '' else None
+
+    def run_get_real_names(users):
+        return merge_cached_real_names(server, users, real_names_by_users)
+
+    return format_lines(server, args, gpu_infos, run_ps, run_get_real_names)
+
+
+def probe_server(server, args):
+    """Probes a single server and returns the lines to display for it."""
+    if server in LOCAL_SERVERS:
+        gpu_infos = run_nvidiasmi_local(legacy_xml=args.legacy_xml)
+        return server, format_lines(server, args, gpu_infos, run_ps_local,
+                                    get_real_names_local)
+
+    batch = run_batch_remote(server,
+                             ssh_timeout=args.ssh_timeout,
+                             cmd_timeout=args.cmd_timeout,
+                             with_real_names=args.finger,
+                             legacy_xml=args.legacy_xml)
+    return server, lines_from_batch(server, args, batch)
+
+
+async def probe_server_async(server, args):
+    """Probes a single server over an asyncssh connection."""
+    if server in LOCAL_SERVERS:
+        # Local probing runs subprocesses; keep it off the event loop
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, probe_server, server, args)
+
+    # Only pass username when the server carries one; passing None would
+    # override asyncssh's local-username default
+    options = {'connect_timeout': float(args.ssh_timeout)}
+    host = server
+    if '@' in server:
+        options['username'], _, host = server.partition('@')
+
+    script = build_batch_script(args.finger, args.legacy_xml)
+    try:
+        async with asyncssh.connect(host, **options) as conn:
+            res = await conn.run('timeout {} sh'.format(args.cmd_timeout),
+                                 input=script, check=True)
+    except (OSError, asyncio.TimeoutError, asyncssh.Error) as e:
+        debug('SSH to %s failed: %s', server, e)
+        batch = None
+    else:
+        batch = parse_batch_output(res.stdout, args.finger, args.legacy_xml)
+
+    return server, lines_from_batch(server, args, batch)
+
+
+async def probe_servers_async(servers, args):
+    tasks = [probe_server_async(server, args) for server in servers]
+    for server, lines in await asyncio.gather(*tasks):
+        for line in lines:
+            info(line)
+
+
+def normalize_servers(servers, ssh_user):
+    """Deduplicates servers preserving order and applies the ssh user
+    to entries that do not already carry one."""
+    servers = list(dict.fromkeys(s for s in servers if s != ''))
+    if ssh_user is not None:
+        servers = [s if '@' in s else '{}@{}'.format(ssh_user, s)
+                   for s in servers]
+    return servers
+
+
+def get_servers(args, cache):
+    """Returns the list of servers to probe.
+
+    Servers given on the command line are used as-is. Otherwise the
+    server file is read, and in daemon mode re-read only when its
+    modification time changed.
+    """
+    if len(args.servers) > 0:
+        return args.servers
+
+    try:
+        mtime = os.stat(args.server_file).st_mtime
+    except OSError:
+        error('Could not open server file %s', args.server_file)
+        return None
+
+    if cache.get('mtime') != mtime:
+        try:
+            debug('Using server file %s', args.server_file)
+            text = pathlib.Path(args.server_file).read_text()
+        except OSError:
+            error('Could not open server file %s', args.server_file)
+            return None
+
+        # Everything after a '#' is a comment; blank lines are skipped
+        servers = (line.partition('#')[0].strip()
+                   for line in text.splitlines())
+        servers = [s for s in servers if s != '']
+
+        cache['mtime'] = mtime
+        cache['servers'] = normalize_servers(servers, args.ssh_user)
+
+    return cache['servers']
+
+
+def probe_servers(executor, probe, servers):
+    # Servers are probed concurrently as the work is I/O-bound on SSH,
+    # so one slow or dead host does not stall the others
+    for server, lines in executor.map(probe, servers):
+        for line in lines:
+            info(line)
 
 
 def main(argv):
@@ -228,24 +637,11 @@ def main(argv):
     logging.basicConfig(format='%(message)s',
                         level=logging.DEBUG if args.verbose else logging.INFO)
 
-    if len(args.servers) == 0:
-        try:
-            debug('Using server file {}'.format(args.server_file))
-            with open(args.server_file, 'r') as f:
-                servers = (s.strip() for s in f.readlines())
-                args.servers = [s for s in servers if s != '']
-        except OSError as e:
-            error('Could not open server file {}'.format(args.server_file))
-            return
-
-    if len(args.servers) == 0:
-        error(('No GPU servers to connect to specified.\nPut addresses in '
-               'the server file or specify them manually as an argument'))
-        return
-
-    if args.ssh_user is not None:
-        args.servers = ['{}@{}'.format(args.ssh_user, server)
-                        for server in args.servers]
+    # Keep asyncssh's connection chatter out of the regular output
+    if not args.verbose:
+        logging.getLogger('asyncssh').setLevel(logging.WARNING)
+
+    args.servers = normalize_servers(args.servers, args.ssh_user)
     if args.me:
         if args.ssh_user is not None:
             args.user = args.ssh_user
@@ -254,39 +650,33 @@ def main(argv):
     if args.user or args.finger:
         args.list = True
 
-    for server in args.servers:
-        if server == '.' or server == 'localhost' or server == '127.0.0.1':
-            run_nvidiasmi = run_nvidiasmi_local
-            run_ps = run_ps_local
-            run_get_real_names = get_real_names_local
-        else:
-            run_nvidiasmi = partial(run_nvidiasmi_remote,
-                                    server=server,
-                                    ssh_timeout=args.ssh_timeout,
-                                    cmd_timeout=args.cmd_timeout)
-            run_ps = partial(run_ps_remote,
-                             server=server,
-                             ssh_timeout=args.ssh_timeout,
-                             cmd_timeout=args.cmd_timeout)
-            run_get_real_names = partial(get_real_names_remote,
-                                         server=server,
-                                         ssh_timeout=args.ssh_timeout,
-                                         cmd_timeout=args.cmd_timeout)
-
-        nvidiasmi = run_nvidiasmi()
-        if nvidiasmi is None:
-            error(('Could not reach {} or '
-                   'error running nvidia-smi').format(server))
-            continue
-
-        gpu_infos = get_gpu_infos(nvidiasmi)
-
-        if args.list:
-            print_gpu_infos(server, gpu_infos, run_ps, run_get_real_names,
-                            filter_by_user=args.user,
-                            translate_to_real_names=args.finger)
-        else:
-            print_free_gpus(server, gpu_infos)
+    os.makedirs(CONTROL_PATH_DIR, mode=0o700, exist_ok=True)
+
+    server_cache = {}
+    probe = partial(probe_server, args=args)
+    # Worker threads are created lazily and reused across daemon
+    # iterations instead of respawning a pool every tick
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        while True:
+            servers = get_servers(args, server_cache)
+            if servers is None:
+                return
+
+            if len(servers) == 0:
+                error(('No GPU servers to connect to specified.\n'
+                       'Put addresses in the server file or specify them '
+                       'manually as an argument'))
+                return
+
+            if asyncssh is not None:
+                asyncio.run(probe_servers_async(servers, args))
+            else:
+                probe_servers(executor, probe, servers)
+
+            if not args.daemon:
+                break
+
+            time.sleep(float(args.interval))
 
 
 if __name__ == '__main__':